@@ -0,0 +1,13 @@
+"""
+Shared flag record emitted by all agents.
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Flag:
+    layer: str
+    severity: str
+    description: str
+    confidence: float
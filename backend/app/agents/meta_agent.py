@@ -3,12 +3,19 @@ Agent Meta: Metadata Forensics
 Extracts and analyzes EXIF data from images to detect editing software.
 """
 
+import asyncio
+import logging
+import os
+import re
+import exifread
+from exifread.tags import DEFAULT_STOP_TAG
 from PIL import Image
 from PIL.ExifTags import TAGS
 from io import BytesIO
 from typing import Optional
 from dataclasses import dataclass, field
 from typing import List
+from .flags import Flag
 
 # Known editing software signatures
 EDITING_SOFTWARE = [
@@ -17,13 +24,57 @@ EDITING_SOFTWARE = [
     "adobe", "edit", "modified"
 ]
 
-@dataclass
+# All signatures folded into one alternation so each string is scanned once
+# (longest first, so a more specific signature wins at the same position)
+_EDIT_RE = re.compile(
+    "|".join(map(re.escape, sorted(EDITING_SOFTWARE, key=len, reverse=True))),
+    re.IGNORECASE
+)
+
+
+def _match_editor(text: str) -> Optional[str]:
+    """Return the editing-software signature found in text, if any."""
+    match = _EDIT_RE.search(text)
+    return match.group(0).lower() if match else None
+
+# exifread warns for every file it can't parse (EXIF-less PNG/GIF/BMP
+# screenshots, WebP); those go to the Pillow fallback, so keep it quiet
+logging.getLogger("exifread").setLevel(logging.ERROR)
+
+# Reverse EXIF lookup (name -> tag id) for the handful of tags we act on
+# (used by the Pillow fallback)
+_TAG_IDS = {name: tag_id for tag_id, name in TAGS.items()}
+_DECISION_TAGS = ("Software", "Make", "Model", "ImageDescription")
+
+# Keep every EXIF tag in raw_exif (debugging only; normally just the decision tags)
+FULL_RAW_EXIF = bool(os.getenv("META_FULL_EXIF"))
+
+# Binary EXIF values (MakerNote, thumbnails, ...) larger than this are dropped
+# from raw_exif instead of being stored as a multi-KB bytes repr
+MAX_EXIF_BLOB_BYTES = 64
+
+
+def _exif_strings(items) -> dict:
+    """Build raw_exif from (name, value) pairs: small blobs as hex, large ones skipped."""
+    raw = {}
+    for name, value in items:
+        if isinstance(value, bytes):
+            if len(value) > MAX_EXIF_BLOB_BYTES:
+                continue
+            raw[name] = value.hex()
+        else:
+            raw[name] = str(value)
+    return raw
+
+
+@dataclass(slots=True)
 class MetaAgentResult:
     is_edited: bool = False
     software_detected: Optional[str] = None
     hardware_detected: Optional[str] = None
-    flags: List[dict] = field(default_factory=list)
+    flags: List[Flag] = field(default_factory=list)
     raw_exif: dict = field(default_factory=dict)
+    failed: bool = False  # metadata could not be read
 
 
 class MetaAgent:
@@ -35,9 +86,10 @@ class MetaAgent:
         self.name = "Agent Meta"
         self.icon = "[META]"
     
-    def analyze(self, image_bytes: bytes) -> MetaAgentResult:
+    async def analyze(self, image_bytes: bytes) -> MetaAgentResult:
         """
         Extract and analyze EXIF metadata from image.
+        Runs in the default executor so it can overlap with the other agents.
         
         Args:
             image_bytes: Raw image bytes
@@ -45,73 +97,128 @@ class MetaAgent:
         Returns:
             MetaAgentResult with findings
         """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._analyze_sync, image_bytes)
+    
+    def _analyze_sync(self, image_bytes: bytes) -> MetaAgentResult:
+        """Blocking EXIF parse behind analyze()."""
         result = MetaAgentResult()
         
         try:
-            image = Image.open(BytesIO(image_bytes))
-            exif_data = image._getexif()
+            exif_data = self._read_exif(image_bytes)
             
             if exif_data is None:
                 # No EXIF is common for screenshots or web images
-                result.flags.append({
-                    "layer": "Metadata",
-                    "severity": "LOW",
-                    "description": "No EXIF data (Common in screenshots/digital wallets)",
-                    "confidence": 0.5
-                })
+                result.flags.append(Flag(
+                    layer="Metadata",
+                    severity="LOW",
+                    description="No EXIF data (Common in screenshots/digital wallets)",
+                    confidence=0.5
+                ))
                 return result
             
-            # Parse EXIF tags
-            for tag_id, value in exif_data.items():
-                tag_name = TAGS.get(tag_id, tag_id)
-                result.raw_exif[tag_name] = str(value)
-                
-                # Check for Software tag
-                if tag_name == "Software":
-                    software_str = str(value).lower()
-                    result.software_detected = value
-                    
-                    for editor in EDITING_SOFTWARE:
-                        if editor in software_str:
-                            result.is_edited = True
-                            result.flags.append({
-                                "layer": "Metadata",
-                                "severity": "HIGH",
-                                "description": f"Editing software detected: {value}",
-                                "confidence": 0.95
-                            })
-                            break
+            result.raw_exif = exif_data
+            
+            # Check for Software tag
+            software = exif_data.get("Software")
+            if software is not None:
+                result.software_detected = software
                 
-                # Check for Make/Model (device info)
-                if tag_name == "Make":
-                    result.hardware_detected = str(value)
-                if tag_name == "Model" and result.hardware_detected:
-                    result.hardware_detected += f" {value}"
+                if _match_editor(software):
+                    result.is_edited = True
+                    result.flags.append(Flag(
+                        layer="Metadata",
+                        severity="HIGH",
+                        description=f"Editing software detected: {software}",
+                        confidence=0.95
+                    ))
+            
+            # Check for Make/Model (device info)
+            make = exif_data.get("Make")
+            model = exif_data.get("Model")
+            if make is not None:
+                result.hardware_detected = make
+                if model is not None:
+                    result.hardware_detected += f" {model}"
             
             # Additional check: ImageDescription often contains editing traces
-            if "ImageDescription" in result.raw_exif:
-                desc = result.raw_exif["ImageDescription"].lower()
-                for editor in EDITING_SOFTWARE:
-                    if editor in desc:
-                        result.is_edited = True
-                        result.flags.append({
-                            "layer": "Metadata",
-                            "severity": "MEDIUM",
-                            "description": f"Editing trace in ImageDescription",
-                            "confidence": 0.7
-                        })
-                        break
+            description = exif_data.get("ImageDescription")
+            editor = _match_editor(description) if description is not None else None
+            if editor:
+                result.is_edited = True
+                result.flags.append(Flag(
+                    layer="Metadata",
+                    severity="MEDIUM",
+                    description=f"Editing trace in ImageDescription ({editor})",
+                    confidence=0.7
+                ))
             
         except Exception as e:
-            result.flags.append({
-                "layer": "Metadata",
-                "severity": "LOW",
-                "description": f"Could not parse image metadata: {str(e)}",
-                "confidence": 0.2
-            })
+            result.failed = True
+            result.flags.append(Flag(
+                layer="Metadata",
+                severity="LOW",
+                description=f"Could not parse image metadata: {str(e)}",
+                confidence=0.2
+            ))
         
         return result
     
+    def _read_exif(self, image_bytes: bytes) -> Optional[dict]:
+        """
+        Read EXIF tags as {tag name: string value}, or None if the image has
+        no EXIF at all. Outside FULL_RAW_EXIF mode only the decision tags are
+        kept, so EXIF without any of them gives {}.
+        
+        exifread parses the EXIF segment only, without setting up a pixel
+        decoder. Pillow is the fallback whenever exifread finds nothing: it
+        returns no tags (rather than raising) for containers it doesn't
+        support, such as WebP.
+        """
+        try:
+            tags = exifread.process_file(
+                BytesIO(image_bytes), details=False, extract_thumbnail=False,
+                # IFD0 tags are sorted by id, so Software is the last one we need
+                stop_tag=DEFAULT_STOP_TAG if FULL_RAW_EXIF else "Software"
+            )
+        except Exception:
+            tags = None
+        if not tags:
+            return self._read_exif_pil(image_bytes)
+        
+        if FULL_RAW_EXIF:
+            return _exif_strings(
+                (key.removeprefix("Image "), tag) for key, tag in tags.items()
+            )
+        return {
+            name: str(tags[f"Image {name}"])
+            for name in _DECISION_TAGS
+            if f"Image {name}" in tags
+        }
+    
+    def _read_exif_pil(self, image_bytes: bytes) -> Optional[dict]:
+        """
+        Pillow-based EXIF reader, same output shape as _read_exif.
+        Image.open only parses the header; pixels are never decoded.
+        """
+        image = Image.open(BytesIO(image_bytes))
+        # Only JPEG/PNG/WebP/TIFF-style plugins have _getexif (not GIF/BMP)
+        getexif = getattr(image, "_getexif", None)
+        exif_data = getexif() if getexif is not None else None
+        if exif_data is None:
+            return None
+        
+        if FULL_RAW_EXIF:
+            return _exif_strings(
+                (TAGS.get(tag_id, tag_id), value) for tag_id, value in exif_data.items()
+            )
+        
+        return _exif_strings(
+            (name, exif_data[_TAG_IDS[name]])
+            for name in _DECISION_TAGS
+            if _TAG_IDS[name] in exif_data
+        )
+    
     def get_status_log(self, result: MetaAgentResult) -> List[str]:
         """Generate human-readable log entries for UI display."""
         logs = [
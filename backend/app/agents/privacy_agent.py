@@ -3,37 +3,63 @@ Agent Privacy: OCR & PII Redaction
 Detects and redacts sensitive information before sending to external AI.
 """
 
+import asyncio
+import math
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageDraw, ImageFilter
 from io import BytesIO
 from typing import List, Tuple, Optional
 from dataclasses import dataclass, field
+from .flags import Flag
 
-# Try to import pytesseract, gracefully handle if not installed
+# Tesseract's OpenMP threading is slower than single-threaded on small
+# single-page images like receipts. Must be set before Tesseract is spawned.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# LSTM engine, single uniform block of text (skips full page layout analysis)
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+
+# Longest side (px) of the image handed to OCR; larger uploads are downscaled
+MAX_OCR_DIMENSION = 1600
+
+# Prefer the in-process tesserocr bindings: the language model stays loaded
+# between calls instead of being re-initialized by a subprocess per image
 try:
-    import pytesseract
-    import os
-    
-    # Cross-platform Tesseract detection
-    if os.name == 'nt':  # Windows
-        tesseract_path = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-        if os.path.exists(tesseract_path):
-            pytesseract.pytesseract.tesseract_cmd = tesseract_path
-            TESSERACT_AVAILABLE = True
-        else:
-            TESSERACT_AVAILABLE = False
-            print("[!] Tesseract not found at Windows path. OCR will be simulated.")
-    else:  # Linux/Mac (Vercel runs on Linux)
-        # Try common Linux paths or rely on PATH
-        try:
-            pytesseract.get_tesseract_version()
-            TESSERACT_AVAILABLE = True
-        except Exception:
-            TESSERACT_AVAILABLE = False
-            print("[!] Tesseract not found on system. OCR will be simulated.")
+    import tesserocr
+    TESSEROCR_AVAILABLE = "eng" in tesserocr.get_languages()[1]
 except ImportError:
-    TESSERACT_AVAILABLE = False
-    print("[!] pytesseract not available. OCR will be simulated.")
+    TESSEROCR_AVAILABLE = False
+
+if TESSEROCR_AVAILABLE:
+    TESSERACT_AVAILABLE = True
+else:
+    # Try to import pytesseract, gracefully handle if not installed
+    try:
+        import pytesseract
+    
+        # Cross-platform Tesseract detection
+        if os.name == 'nt':  # Windows
+            tesseract_path = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+            if os.path.exists(tesseract_path):
+                pytesseract.pytesseract.tesseract_cmd = tesseract_path
+                TESSERACT_AVAILABLE = True
+            else:
+                TESSERACT_AVAILABLE = False
+                print("[!] Tesseract not found at Windows path. OCR will be simulated.")
+        else:  # Linux/Mac (Vercel runs on Linux)
+            # Try common Linux paths or rely on PATH
+            try:
+                pytesseract.get_tesseract_version()
+                TESSERACT_AVAILABLE = True
+            except Exception:
+                TESSERACT_AVAILABLE = False
+                print("[!] Tesseract not found on system. OCR will be simulated.")
+    except ImportError:
+        TESSERACT_AVAILABLE = False
+        print("[!] pytesseract not available. OCR will be simulated.")
 
 
 # PII Detection Patterns
@@ -44,8 +70,95 @@ PII_PATTERNS = {
     "email": r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b",
 }
 
+# Single alternation of all PII patterns: one scan per token, the matching
+# named group tells us the PII type. search() returns the leftmost match (dict
+# order only breaks ties at the same position), so a token matching several
+# patterns is labelled by whichever starts first, e.g. "a@b.co/1234567890" is
+# "email", not "account_number". Whether a token is redacted is unaffected.
+_PII_UNION = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, pattern in PII_PATTERNS.items()),
+    re.IGNORECASE
+)
+
+# Common patterns for transaction amounts
+_AMOUNT_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r"(?:PKR|Rs\.?|₨)\s*([\d,]+(?:\.\d{2})?)",  # PKR 5,000.00
+    r"(?:Amount|Total|Paid)\s*:?\s*([\d,]+(?:\.\d{2})?)",  # Amount: 5000
+    r"\b(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)\s*(?:PKR|Rs)",  # 5,000 PKR
+))
+
+
+# Bounded pool for OCR work so scans don't block the event loop. With
+# OMP_THREAD_LIMIT=1 each OCR job uses one core, so default to one worker
+# per core (OCR_WORKERS overrides).
+_OCR_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("OCR_WORKERS", 0)) or os.cpu_count() or 1,
+    thread_name_prefix="ocr"
+)
+
+# One tesserocr handle per OCR worker thread (the API is not re-entrant)
+_tess_local = threading.local()
+
 
-@dataclass
+def _tesserocr_image_to_data(image: Image.Image) -> dict:
+    """Run tesserocr and return word data in pytesseract's image_to_data layout."""
+    data = {key: [] for key in (
+        "text", "left", "top", "width", "height", "block_num", "par_num", "line_num"
+    )}
+    block = par = line = 0
+    
+    api = getattr(_tess_local, "api", None)
+    if api is None:
+        api = _tess_local.api = tesserocr.PyTessBaseAPI(
+            lang="eng",
+            psm=tesserocr.PSM.SINGLE_BLOCK,
+            oem=tesserocr.OEM.LSTM_ONLY
+        )
+    
+    api.SetImage(image)
+    api.Recognize()
+    iterator = api.GetIterator()
+    if iterator is None:
+        return data
+    
+    level = tesserocr.RIL.WORD
+    for word in tesserocr.iterate_level(iterator, level):
+        if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+            block += 1
+            par = line = 0
+        if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+            par += 1
+            line = 0
+        if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+            line += 1
+        
+        text = word.GetUTF8Text(level)
+        bbox = word.BoundingBox(level)
+        if not text or bbox is None:
+            continue
+        
+        x1, y1, x2, y2 = bbox
+        data["text"].append(text)
+        data["left"].append(x1)
+        data["top"].append(y1)
+        data["width"].append(x2 - x1)
+        data["height"].append(y2 - y1)
+        data["block_num"].append(block)
+        data["par_num"].append(par)
+        data["line_num"].append(line)
+    
+    return data
+
+
+# "blur" (default) or "solid". Solid fills PII boxes in place, which is cheaper
+# than the per-box crop/blur/paste and leaves nothing to de-blur.
+REDACTION_MODE = os.getenv("REDACTION_MODE", "blur")
+
+# Upload formats Gemini accepts directly; anything else is re-encoded to PNG
+PASSTHROUGH_FORMATS = {"PNG", "JPEG", "WEBP"}
+
+
+@dataclass(slots=True)
 class RedactionBox:
     x: int
     y: int
@@ -55,13 +168,15 @@ class RedactionBox:
     original_text: str
 
 
-@dataclass
+@dataclass(slots=True)
 class PrivacyAgentResult:
     redacted_image_bytes: Optional[bytes] = None
+    redacted_mime_type: str = "image/png"
     pii_detected: List[dict] = field(default_factory=list)
     text_extracted: str = ""
-    flags: List[dict] = field(default_factory=list)
+    flags: List[Flag] = field(default_factory=list)
     amount_detected: Optional[str] = None
+    failed: bool = False  # scan raised; the result is a pass-through stub
 
 
 class PrivacyAgent:
@@ -73,38 +188,64 @@ class PrivacyAgent:
         self.name = "Agent Privacy"
         self.icon = "[PRIV]"
     
-    def analyze(self, image_bytes: bytes) -> PrivacyAgentResult:
+    async def analyze(
+        self,
+        image_bytes: bytes,
+        image: Optional[Image.Image] = None
+    ) -> PrivacyAgentResult:
         """
         Extract text via OCR, detect PII, and create redacted image.
+        Runs on the shared OCR pool so the event loop stays free.
         
         Args:
             image_bytes: Raw image bytes
+            image: Already-decoded image for these bytes (decoded here if omitted)
             
         Returns:
             PrivacyAgentResult with redacted image and findings
         """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_OCR_POOL, self._analyze_sync, image_bytes, image)
+    
+    async def analyze_batch(self, images: List[bytes]) -> List[PrivacyAgentResult]:
+        """
+        Analyze several receipts at once, fanned out over the OCR pool.
+        
+        Tesseract's list-file batch mode only returns plain text, and word
+        boxes are needed for redaction, so images are OCR'd individually.
+        With tesserocr each pool thread keeps its engine loaded, so the
+        model is initialized once per worker, not once per image.
+        """
+        return list(await asyncio.gather(*(self.analyze(image_bytes) for image_bytes in images)))
+    
+    def _analyze_sync(
+        self,
+        image_bytes: bytes,
+        image: Optional[Image.Image] = None
+    ) -> PrivacyAgentResult:
+        """Blocking OCR + redaction pipeline behind analyze()."""
         result = PrivacyAgentResult()
         
         try:
-            image = Image.open(BytesIO(image_bytes))
+            if image is None:
+                image = Image.open(BytesIO(image_bytes))
             
             if TESSERACT_AVAILABLE:
-                # Full OCR with bounding boxes
-                ocr_data = pytesseract.image_to_data(
-                    image, output_type=pytesseract.Output.DICT
-                )
-                result.text_extracted = pytesseract.image_to_string(image)
+                # Full OCR with bounding boxes (on a downscaled copy if large)
+                ocr_data = self._run_ocr_scaled(image)
+                result.text_extracted = self._text_from_ocr_data(ocr_data)
                 
                 # Find PII and create redaction boxes
                 redaction_boxes = self._find_pii_boxes(ocr_data)
                 
-                # Apply redactions
-                redacted_image = self._apply_redactions(image.copy(), redaction_boxes)
-                
-                # Convert back to bytes
-                buffer = BytesIO()
-                redacted_image.save(buffer, format="PNG")
-                result.redacted_image_bytes = buffer.getvalue()
+                if not redaction_boxes and image.format in PASSTHROUGH_FORMATS:
+                    # Nothing to redact: forward the original upload as-is
+                    result.redacted_image_bytes = image_bytes
+                    result.redacted_mime_type = Image.MIME[image.format]
+                else:
+                    # Apply redactions
+                    redacted_image = self._apply_redactions(image.copy(), redaction_boxes)
+                    result.redacted_image_bytes = self._encode_png(redacted_image)
                 
                 # Record what was redacted
                 for box in redaction_boxes:
@@ -116,86 +257,139 @@ class PrivacyAgent:
             else:
                 # Fallback: Tesseract not found even after config
                 result.text_extracted = "[OCR Error: Tesseract executable not found at configured path]"
-                result.redacted_image_bytes = image_bytes
+                if image.format in PASSTHROUGH_FORMATS:
+                    result.redacted_image_bytes = image_bytes
+                    result.redacted_mime_type = Image.MIME[image.format]
+                else:
+                    # GIF/BMP/TIFF/...: not image types Gemini accepts
+                    result.redacted_image_bytes = self._encode_png(image)
                 
-                result.flags.append({
-                    "layer": "Privacy",
-                    "severity": "LOW",
-                    "description": "OCR engine not found. Privacy redaction skipped.",
-                    "confidence": 0.5
-                })
+                result.flags.append(Flag(
+                    layer="Privacy",
+                    severity="LOW",
+                    description="OCR engine not found. Privacy redaction skipped.",
+                    confidence=0.5
+                ))
             
             # Try to extract amount from text
             result.amount_detected = self._extract_amount(result.text_extracted)
             
         except Exception as e:
-            result.flags.append({
-                "layer": "Privacy",
-                "severity": "LOW",
-                "description": f"Privacy scan error: {str(e)}",
-                "confidence": 0.3
-            })
+            result.failed = True
+            result.flags.append(Flag(
+                layer="Privacy",
+                severity="LOW",
+                description=f"Privacy scan error: {str(e)}",
+                confidence=0.3
+            ))
             result.redacted_image_bytes = image_bytes
         
         return result
     
+    def _encode_png(self, image: Image.Image) -> bytes:
+        """PNG bytes for Gemini (fastest zlib level; sent, not stored)."""
+        buffer = BytesIO()
+        image.save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+    
+    def _run_ocr(self, image: Image.Image) -> dict:
+        """Word-level OCR data (text + bounding boxes) from the best available engine."""
+        if TESSEROCR_AVAILABLE:
+            return _tesserocr_image_to_data(image)
+        return pytesseract.image_to_data(
+            image, config=TESSERACT_CONFIG, output_type=pytesseract.Output.DICT
+        )
+    
+    def _run_ocr_scaled(self, image: Image.Image) -> dict:
+        """
+        OCR a copy no larger than MAX_OCR_DIMENSION and map the word boxes
+        back to original-image coordinates. Receipt text doesn't need more
+        pixels than that, and OCR time grows with pixel count.
+        """
+        longest = max(image.size)
+        if longest <= MAX_OCR_DIMENSION:
+            return self._run_ocr(image)
+        
+        scale = MAX_OCR_DIMENSION / longest
+        ocr_image = image.resize(
+            (int(image.width * scale), int(image.height * scale)), Image.BILINEAR
+        )
+        ocr_data = self._run_ocr(ocr_image)
+        
+        # Round boxes outward so redaction still covers the whole word
+        for key in ("left", "top"):
+            ocr_data[key] = [int(v / scale) for v in ocr_data[key]]
+        for key in ("width", "height"):
+            ocr_data[key] = [math.ceil(v / scale) for v in ocr_data[key]]
+        
+        return ocr_data
+    
+    def _text_from_ocr_data(self, ocr_data: dict) -> str:
+        """Rebuild plain text from OCR word data (avoids a second Tesseract run)."""
+        lines = {}
+        for i, text in enumerate(ocr_data['text']):
+            if not text.strip():
+                continue
+            key = (ocr_data['block_num'][i], ocr_data['par_num'][i], ocr_data['line_num'][i])
+            lines.setdefault(key, []).append(text)
+        
+        return "\n".join(" ".join(words) for words in lines.values())
+    
     def _find_pii_boxes(self, ocr_data: dict) -> List[RedactionBox]:
         """Find text regions matching PII patterns."""
         boxes = []
-        n_boxes = len(ocr_data['text'])
         
-        for i in range(n_boxes):
-            text = ocr_data['text'][i].strip()
+        # Hoist column lookups and the bound append out of the per-token loop
+        lefts, tops = ocr_data['left'], ocr_data['top']
+        widths, heights = ocr_data['width'], ocr_data['height']
+        search = _PII_UNION.search
+        append = boxes.append
+        
+        for i, text in enumerate(ocr_data['text']):
+            text = text.strip()
             if not text:
                 continue
             
-            for pii_type, pattern in PII_PATTERNS.items():
-                if re.search(pattern, text):
-                    boxes.append(RedactionBox(
-                        x=ocr_data['left'][i],
-                        y=ocr_data['top'][i],
-                        width=ocr_data['width'][i],
-                        height=ocr_data['height'][i],
-                        pii_type=pii_type,
-                        original_text=text
-                    ))
-                    break
+            match = search(text)
+            if match:
+                append(RedactionBox(
+                    lefts[i], tops[i], widths[i], heights[i],
+                    match.lastgroup, text
+                ))
         
         return boxes
     
     def _apply_redactions(self, image: Image.Image, boxes: List[RedactionBox]) -> Image.Image:
-        """Apply blur redaction to detected PII regions."""
+        """Apply blur (or solid) redaction to detected PII regions."""
         draw = ImageDraw.Draw(image)
+        solid = REDACTION_MODE == "solid"
+        img_width, img_height = image.size
         
         for box in boxes:
-            # Extract region
-            region = image.crop((
-                box.x, box.y,
-                box.x + box.width, box.y + box.height
-            ))
-            # Apply strong blur
-            blurred = region.filter(ImageFilter.GaussianBlur(radius=15))
-            # Paste back
-            image.paste(blurred, (box.x, box.y))
+            # Clamp to the image; crop() would otherwise pad with black
+            x1, y1 = max(box.x, 0), max(box.y, 0)
+            x2 = min(box.x + box.width, img_width)
+            y2 = min(box.y + box.height, img_height)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            
+            if solid:
+                # Fill in place: no intermediate region images at all
+                draw.rectangle([x1, y1, x2, y2], fill="#000000", outline="#FF0000", width=2)
+                continue
+            
+            # Extract region, apply strong blur, and paste back
+            blurred = image.crop((x1, y1, x2, y2)).filter(ImageFilter.GaussianBlur(radius=15))
+            image.paste(blurred, (x1, y1))
             # Draw border to indicate redaction
-            draw.rectangle(
-                [box.x, box.y, box.x + box.width, box.y + box.height],
-                outline="#FF0000", width=2
-            )
+            draw.rectangle([x1, y1, x2, y2], outline="#FF0000", width=2)
         
         return image
     
     def _extract_amount(self, text: str) -> Optional[str]:
         """Try to extract transaction amount from OCR text."""
-        # Common patterns for amounts
-        patterns = [
-            r"(?:PKR|Rs\.?|₨)\s*([\d,]+(?:\.\d{2})?)",  # PKR 5,000.00
-            r"(?:Amount|Total|Paid)\s*:?\s*([\d,]+(?:\.\d{2})?)",  # Amount: 5000
-            r"\b(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)\s*(?:PKR|Rs)",  # 5,000 PKR
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in _AMOUNT_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1).replace(",", "")
         
@@ -210,7 +404,7 @@ class PrivacyAgent:
         
         if result.pii_detected:
             logs.append(f"{self.icon} Detected {len(result.pii_detected)} PII regions")
-            logs.append(f"{self.icon} Applying blur redaction...")
+            logs.append(f"{self.icon} Applying {REDACTION_MODE} redaction...")
         else:
             logs.append(f"{self.icon} No PII patterns detected")
         
@@ -3,10 +3,10 @@ Agent Vision: Gemini-Powered Visual Analysis
 Analyzes redacted images for forensic inconsistencies.
 """
 
-import json
 from datetime import datetime
 from typing import Optional, List
 from dataclasses import dataclass, field
+from .flags import Flag
 from ..gemini_client import gemini_client
 
 
@@ -40,7 +40,19 @@ Respond in this exact JSON format:
 """
 
 
-@dataclass
+def _format_context(context: Optional[dict]) -> str:
+    """Render transaction context for the prompt ("" when there is none)."""
+    if not context:
+        return ""
+    return (
+        "ADDITIONAL CONTEXT:\n"
+        f"- Claimed Amount: {context.get('claimed_amount', 'Unknown')}\n"
+        f"- Expected Bank: {context.get('expected_bank', 'Unknown')}\n"
+        f"- Transaction Time: {context.get('transaction_time', 'Unknown')}\n"
+    )
+
+
+@dataclass(slots=True)
 class VisionAgentResult:
     is_suspicious: bool = False
     confidence: float = 0.0
@@ -49,8 +61,9 @@ class VisionAgentResult:
     findings: List[dict] = field(default_factory=list)
     explanation: str = ""
     model_used: Optional[str] = None
-    flags: List[dict] = field(default_factory=list)
+    flags: List[Flag] = field(default_factory=list)
     raw_response: str = ""
+    parsed: bool = False  # Gemini returned a usable JSON analysis
 
 
 class VisionAgent:
@@ -62,44 +75,45 @@ class VisionAgent:
         self.name = "Agent Vision"
         self.icon = "[VISION]"
     
-    async def analyze(self, image_bytes: bytes, context: Optional[dict] = None) -> VisionAgentResult:
+    async def analyze(
+        self,
+        image_bytes: bytes,
+        context: Optional[dict] = None,
+        mime_type: str = "image/png"
+    ) -> VisionAgentResult:
         """
         Send redacted image to Gemini for visual forensic analysis.
         
         Args:
             image_bytes: Redacted image bytes
             context: Optional transaction context (claimed amount, etc.)
+            mime_type: MIME type of image_bytes
             
         Returns:
             VisionAgentResult with Gemini's analysis
         """
         result = VisionAgentResult()
         
-        # Build prompt with context if available
-        prompt = VISION_PROMPT
+        # Static instructions go in the system instruction; only the
+        # per-request time and context are sent as the user prompt
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        prompt += f"\n\nCURRENT SYSTEM TIME: {current_time}\n"
-        
-        if context:
-            prompt += f"ADDITIONAL CONTEXT:\n"
-            prompt += f"- Claimed Amount: {context.get('claimed_amount', 'Unknown')}\n"
-            prompt += f"- Expected Bank: {context.get('expected_bank', 'Unknown')}\n"
-            prompt += f"- Transaction Time: {context.get('transaction_time', 'Unknown')}\n"
+        prompt = f"CURRENT SYSTEM TIME: {current_time}\n{_format_context(context)}"
         
         # Call Gemini with fallback
         gemini_result = await gemini_client.analyze_image(
             prompt=prompt,
             image_bytes=image_bytes,
-            mime_type="image/png"
+            mime_type=mime_type,
+            system_instruction=VISION_PROMPT
         )
         
         if not gemini_result["success"]:
-            result.flags.append({
-                "layer": "Vision",
-                "severity": "HIGH",
-                "description": f"AI analysis failed: {gemini_result['error']}",
-                "confidence": 0.0
-            })
+            result.flags.append(Flag(
+                layer="Vision",
+                severity="HIGH",
+                description=f"AI analysis failed: {gemini_result['error']}",
+                confidence=0.0
+            ))
             result.explanation = "AI analysis could not be completed."
             return result
         
@@ -108,15 +122,7 @@ class VisionAgent:
         
         # Parse the JSON response - Robust JSON extraction
         try:
-            # Find the first '{' and last '}'
-            start_idx = gemini_result["response"].find('{')
-            end_idx = gemini_result["response"].rfind('}')
-            
-            if start_idx != -1 and end_idx != -1:
-                json_str = gemini_result["response"][start_idx:end_idx+1]
-                analysis = json.loads(json_str)
-            else:
-                raise ValueError("No JSON object found in response")
+            analysis = gemini_client.parse_json_response(gemini_result)
         
             result.is_suspicious = analysis.get("is_suspicious", False)
             result.confidence = analysis.get("confidence", 0.5)
@@ -126,24 +132,26 @@ class VisionAgent:
             
             # Convert findings to flags
             for finding in analysis.get("findings", []):
-                result.flags.append({
-                    "layer": "Vision",
-                    "severity": finding.get("severity", "MEDIUM"),
-                    "description": finding.get("issue", "Unknown issue"),
-                    "confidence": result.confidence
-                })
-        except (json.JSONDecodeError, ValueError) as e:
+                result.flags.append(Flag(
+                    layer="Vision",
+                    severity=finding.get("severity", "MEDIUM"),
+                    description=finding.get("issue", "Unknown issue"),
+                    confidence=result.confidence
+                ))
+            
+            result.parsed = True
+        except ValueError as e:  # includes orjson.JSONDecodeError
             # Fallback: Treat raw response as explanation but MARK AS FAILED
             print(f"[VISION] JSON Parse Error: {str(e)}")
             print(f"[VISION] Raw Response: {gemini_result['response']}")
             
             result.explanation = "AI Analysis Error: Could not parse response."
-            result.flags.append({
-                "layer": "Vision",
-                "severity": "LOW",
-                "description": "Could not parse structured AI response",
-                "confidence": 0.3
-            })
+            result.flags.append(Flag(
+                layer="Vision",
+                severity="LOW",
+                description="Could not parse structured AI response",
+                confidence=0.3
+            ))
         
         return result
     
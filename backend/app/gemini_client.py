@@ -3,13 +3,20 @@ Gemini API Client with Model Fallback Strategy
 Priority: gemini-3-pro-preview → gemini-3-flash-preview → gemini-2.5-flash
 """
 
+import asyncio
+import logging
 import os
+import random
+import time
 from pathlib import Path
+import orjson
 import google.generativeai as genai
 from google.api_core.exceptions import ResourceExhausted, GoogleAPIError
 from typing import Optional
 from dotenv import load_dotenv
 
+logger = logging.getLogger("gemini_client")
+
 # Load .env from backend directory
 env_path = Path(__file__).parent.parent / ".env"
 load_dotenv(env_path)
@@ -26,6 +33,20 @@ MODEL_PRIORITY = [
     "gemini-1.5-flash",        # 1.5 Flash (Last Resort)
 ]
 
+# Rate-limit (ResourceExhausted) handling: retry the same model with
+# exponential backoff + jitter before falling through to the next one
+RATE_LIMIT_ATTEMPTS = 2        # calls per model, including the first
+RATE_LIMIT_BASE_DELAY = 1.0    # seconds, doubled per retry
+RATE_LIMIT_COOLDOWN = 60.0     # seconds a still-limited model is skipped
+
+# Model name -> time.monotonic() deadline before which it is skipped
+_MODEL_COOLDOWNS: dict = {}
+
+# Hedged requests: race the top HEDGE_WIDTH models and keep the first success.
+# Off by default since it can double quota usage per scan.
+HEDGED_REQUESTS = bool(os.getenv("GEMINI_HEDGED"))
+HEDGE_WIDTH = 2
+
 class GeminiClient:
     _instance = None
     _initialized = False
@@ -38,30 +59,80 @@ class GeminiClient:
     def __init__(self):
         if self._initialized:
             return
-            
+        
+        # (model name, system instruction) -> GenerativeModel, reused across requests
+        self._models = {}
+        
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
-            print("[!] CRITICAL: GEMINI_API_KEY not found in environment! AI analysis will be SIMULATED (always returns Risk 0).")
+            logger.warning("GEMINI_API_KEY not found in environment! AI analysis will be SIMULATED (always returns Risk 0).")
             self.api_key = None
         else:
-            print(f"[OK] GEMINI_API_KEY found (ends with ...{api_key[-4:]})")
+            logger.info("GEMINI_API_KEY found (ends with ...%s)", api_key[-4:])
             self.api_key = api_key
             genai.configure(api_key=api_key)
         
         self._initialized = True
     
-    def _get_model(self, model_name: str):
-        """Initialize a Gemini model instance."""
-        return genai.GenerativeModel(model_name)
+    def _get_model(self, model_name: str, system_instruction: Optional[str] = None):
+        """Get (or create once) the Gemini model instance for this configuration."""
+        key = (model_name, system_instruction)
+        model = self._models.get(key)
+        if model is None:
+            model = self._models[key] = genai.GenerativeModel(
+                model_name, system_instruction=system_instruction
+            )
+        return model
+    
+    def _available_models(self) -> list:
+        """Priority chain minus models still cooling down from rate limits."""
+        now = time.monotonic()
+        models = [m for m in MODEL_PRIORITY if _MODEL_COOLDOWNS.get(m, 0.0) <= now]
+        # Everything is cooling down: trying beats failing outright
+        return models or MODEL_PRIORITY
+    
+    async def _call_with_backoff(self, model_name: str, model, contents, generation_config: dict):
+        """
+        Call Gemini without blocking the event loop, retrying ResourceExhausted
+        with exponential backoff + jitter. A model that is still rate limited
+        after the last attempt goes on cooldown and the error is re-raised.
+        """
+        for attempt in range(RATE_LIMIT_ATTEMPTS):
+            try:
+                return await self._generate(model, contents, generation_config)
+            except ResourceExhausted:
+                if attempt == RATE_LIMIT_ATTEMPTS - 1:
+                    _MODEL_COOLDOWNS[model_name] = time.monotonic() + RATE_LIMIT_COOLDOWN
+                    raise
+                delay = RATE_LIMIT_BASE_DELAY * (2 ** attempt) + random.uniform(0, 0.5)
+                logger.warning("Rate limit hit on %s, retrying in %.1fs...", model_name, delay)
+                await asyncio.sleep(delay)
+    
+    async def _generate(self, model, contents, generation_config: dict):
+        """
+        Prefer the SDK's native async call; older google-generativeai
+        releases only have the blocking one, which goes to a worker thread.
+        """
+        generate_async = getattr(model, "generate_content_async", None)
+        if generate_async is not None:
+            return await generate_async(contents, generation_config=generation_config)
+        return await asyncio.to_thread(
+            model.generate_content,
+            contents,
+            generation_config=generation_config
+        )
     
     async def analyze_image(
         self,
         prompt: str,
         image_bytes: bytes,
-        mime_type: str = "image/png"
+        mime_type: str = "image/png",
+        system_instruction: Optional[str] = None
     ) -> dict:
         """
         Send image + prompt to Gemini with automatic fallback on rate limit.
+        A fixed system_instruction is kept separate from the per-call prompt
+        so Gemini can reuse it as a cached prefix.
         """
         if not self.api_key:
             # Simulated response for demo without API key
@@ -79,45 +150,33 @@ class GeminiClient:
                 "error": None
             }
         
-        image_part = {
-            "mime_type": mime_type,
-            "data": image_bytes
-        }
+        # Build the proto once: a plain dict would be re-converted (copying the
+        # image bytes) on every attempt of the fallback chain
+        image_part = genai.protos.Part(
+            inline_data=genai.protos.Blob(mime_type=mime_type, data=image_bytes)
+        )
+        
+        if HEDGED_REQUESTS:
+            return await self._analyze_image_hedged(prompt, image_part, system_instruction)
         
         last_error = None
         
-        for model_name in MODEL_PRIORITY:
+        for model_name in self._available_models():
             try:
-                print(f"[AI] Trying model: {model_name}...")
-                model = self._get_model(model_name)
-                response = model.generate_content(
-                    [prompt, image_part],
-                    generation_config={
-                        "temperature": 0.2,
-                        "max_output_tokens": 2048,
-                    }
-                )
-                
-                print(f"[OK] Success with {model_name}")
-                return {
-                    "success": True,
-                    "model_used": model_name,
-                    "response": response.text,
-                    "error": None
-                }
+                return await self._try_model(model_name, prompt, image_part, system_instruction)
                 
             except ResourceExhausted as e:
-                print(f"[!] Rate limit hit on {model_name}, trying next...")
+                logger.warning("Rate limit hit on %s, trying next...", model_name)
                 last_error = str(e)
                 continue
                 
             except GoogleAPIError as e:
-                print(f"[X] API error on {model_name}: {e}")
+                logger.warning("API error on %s: %s", model_name, e)
                 last_error = str(e)
                 continue
             
             except Exception as e:
-                print(f"[X] Unexpected error on {model_name}: {e}")
+                logger.warning("Unexpected error on %s: %s", model_name, e)
                 last_error = str(e)
                 continue
         
@@ -129,6 +188,106 @@ class GeminiClient:
             "error": f"All models failed. Last error: {last_error}"
         }
     
+    async def _try_model(
+        self,
+        model_name: str,
+        prompt: str,
+        image_part,
+        system_instruction: Optional[str] = None
+    ) -> dict:
+        """One analyze_image attempt on a single model. Raises on failure."""
+        logger.info("Trying model: %s", model_name)
+        model = self._get_model(model_name, system_instruction)
+        response = await self._call_with_backoff(
+            model_name,
+            model,
+            [prompt, image_part],
+            generation_config={
+                "temperature": 0.2,
+                "max_output_tokens": 2048,
+            }
+        )
+        
+        logger.info("Success with %s", model_name)
+        return {
+            "success": True,
+            "model_used": model_name,
+            "response": response.text,
+            "error": None
+        }
+    
+    async def _analyze_image_hedged(
+        self,
+        prompt: str,
+        image_part,
+        system_instruction: Optional[str] = None
+    ) -> dict:
+        """
+        Hedged variant of the fallback chain: keep HEDGE_WIDTH models in
+        flight, return the first success and cancel the rest. Each failure
+        starts the next model in priority order.
+        """
+        models = iter(self._available_models())
+        running = {}  # task -> model name
+        last_error = None
+        
+        def launch_next():
+            model_name = next(models, None)
+            if model_name is not None:
+                task = asyncio.create_task(
+                    self._try_model(model_name, prompt, image_part, system_instruction)
+                )
+                running[task] = model_name
+        
+        for _ in range(HEDGE_WIDTH):
+            launch_next()
+        
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    model_name = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    logger.warning("Error on %s: %s", model_name, error)
+                    last_error = str(error)
+                    launch_next()
+        finally:
+            # Losers (or everything, if we were cancelled ourselves)
+            for task in running:
+                task.cancel()
+        
+        return {
+            "success": False,
+            "model_used": None,
+            "response": None,
+            "error": f"All models failed. Last error: {last_error}"
+        }
+    
+    @staticmethod
+    def parse_json_response(result: dict) -> dict:
+        """
+        Parse the JSON object in a successful analyze_* result. Bare JSON is
+        parsed directly; otherwise (e.g. wrapped in a ```json fence or prose)
+        the outermost {...} is used. Raises ValueError if there is none.
+        """
+        response_text = result["response"]
+        try:
+            parsed = orjson.loads(response_text)
+            if isinstance(parsed, dict):
+                return parsed
+        except orjson.JSONDecodeError:
+            pass
+        
+        # Find the first '{' and last '}'
+        start_idx = response_text.find('{')
+        end_idx = response_text.rfind('}')
+        
+        if start_idx != -1 and end_idx != -1:
+            return orjson.loads(response_text[start_idx:end_idx+1])
+        raise ValueError("No JSON object found in response")
+    
     async def analyze_text(self, prompt: str) -> dict:
         """Text-only analysis with fallback."""
         if not self.api_key:
@@ -141,10 +300,12 @@ class GeminiClient:
         
         last_error = None
         
-        for model_name in MODEL_PRIORITY:
+        for model_name in self._available_models():
             try:
                 model = self._get_model(model_name)
-                response = model.generate_content(
+                response = await self._call_with_backoff(
+                    model_name,
+                    model,
                     prompt,
                     generation_config={
                         "temperature": 0.1,
@@ -160,7 +321,7 @@ class GeminiClient:
                 }
                 
             except ResourceExhausted:
-                print(f"[!] Rate limit hit on {model_name}, trying next...")
+                logger.warning("Rate limit hit on %s, trying next...", model_name)
                 continue
                 
             except GoogleAPIError as e:
@@ -8,12 +8,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 import base64
+import logging
 import os
 
-from .schemas import TransactionContext, BankProvider, AnalysisResult
-from .orchestrator import Orchestrator
-
+# Load env and configure logging before the app modules log at import time
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+
+from .schemas import TransactionContext, BankProvider, AgentStatusOut, ScanResponse
+from .orchestrator import Orchestrator, OrchestratorResult
 
 app = FastAPI(
     title="Deriv P2P Sentinel",
@@ -23,6 +26,42 @@ app = FastAPI(
     root_path=""
 )
 
+# Upload limits
+MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10MB
+_FORM_OVERHEAD_BYTES = 64 * 1024     # multipart envelope + the other form fields
+
+class ScanUploadLimitMiddleware:
+    """
+    Reject /scan uploads whose declared Content-Length is over the limit.
+    Runs before FastAPI parses (and spools) the multipart body.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/scan":
+            content_length = 0
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    try:
+                        content_length = int(value)
+                    except ValueError:
+                        pass
+                    break
+            if content_length > MAX_IMAGE_BYTES + _FORM_OVERHEAD_BYTES:
+                response = JSONResponse(
+                    status_code=400,
+                    content={"detail": "Image too large. Maximum size is 10MB."}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+# Added before CORS so it sits inside it (rejections still get CORS headers)
+# and inside the prefix stripping below (it sees the stripped path)
+app.add_middleware(ScanUploadLimitMiddleware)
+
 # CORS setup for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -33,45 +72,66 @@ app.add_middleware(
 )
 
 # Path stripping middleware for Vercel
-from starlette.middleware.base import BaseHTTPMiddleware
+_API_PREFIX = "/api/py"
+_API_PREFIX_LEN = len(_API_PREFIX)
 
-class StripApiPrefixMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
+class StripApiPrefixMiddleware:
+    """Plain ASGI middleware: rewrites the path without wrapping the request."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
         # Strip /api/py prefix if present
-        if request.scope["path"].startswith("/api/py"):
-            request.scope["path"] = request.scope["path"].replace("/api/py", "", 1)
-            if not request.scope["path"]:
-                request.scope["path"] = "/"
-        return await call_next(request)
+        if scope["type"] in ("http", "websocket"):
+            path = scope["path"]
+            if path.startswith(_API_PREFIX):
+                scope = dict(scope)
+                scope["path"] = path[_API_PREFIX_LEN:] or "/"
+        await self.app(scope, receive, send)
 
 app.add_middleware(StripApiPrefixMiddleware)
 
 # Initialize orchestrator
 orchestrator = Orchestrator()
 
+# Form value -> BankProvider (unknown values map to UNKNOWN)
+_BANK_BY_VALUE = {bank.value: bank for bank in BankProvider}
+
+
+def _scan_response(result: OrchestratorResult) -> ScanResponse:
+    """Shape an orchestrator result for the /scan endpoints."""
+    return ScanResponse(
+        success=True,
+        analysis=result.analysis,
+        agents=[
+            AgentStatusOut(
+                name=status.name,
+                icon=status.icon,
+                status=status.status,
+                logs=status.logs
+            )
+            for status in result.agent_statuses
+        ],
+        logs=result.all_logs
+    )
 
-@app.api_route("/", methods=["GET", "POST"])
-async def health_check(request: Request):
-    """
-    Health check & Debug endpoint.
-    Accepts POST to catch 405 errors caused by path stripping.
-    """
-    return {
-        "status": "online",
-        "service": "Deriv P2P Sentinel",
-        "version": "1.0.0",
-        "agents": ["Agent Meta", "Agent Privacy", "Agent Vision"],
-        "debug": {
-            "received_method": request.method,
-            "received_path": request.url.path,
-            "raw_path": request.scope.get("path"),
-            "root_path": request.scope.get("root_path"),
-            "full_scope_path": request.scope.get("path")
-        }
-    }
 
+# Supported image formats (upload content types)
+SUPPORTED_FORMATS = frozenset({
+    "image/png",
+    "image/jpeg",
+    "image/jpg",
+    "image/webp",
+    "image/gif",
+    "image/bmp",
+    "image/tiff",
+    "image/heic",
+    "image/heif",
+})
 
-@app.post("/scan", response_model=dict)
+
+@app.post("/scan", response_model=ScanResponse)
 async def scan_receipt(
     image: UploadFile = File(...),
     claimed_amount: float = Form(...),
@@ -92,19 +152,6 @@ async def scan_receipt(
     Returns:
         Analysis result with risk score, verdict, and forensic flags
     """
-    # Supported image formats
-    SUPPORTED_FORMATS = [
-        "image/png", 
-        "image/jpeg", 
-        "image/jpg",
-        "image/webp",
-        "image/gif",
-        "image/bmp",
-        "image/tiff",
-        "image/heic",
-        "image/heif"
-    ]
-    
     # Validate file type
     if image.content_type not in SUPPORTED_FORMATS:
         raise HTTPException(
@@ -112,20 +159,18 @@ async def scan_receipt(
             detail=f"Invalid file type '{image.content_type}'. Supported: PNG, JPEG, WebP, GIF, BMP, TIFF, HEIC"
         )
     
-    # Read image bytes
-    image_bytes = await image.read()
+    # Read image bytes; one byte past the limit is enough to tell it's too
+    # large (the middleware only sees the declared Content-Length)
+    image_bytes = await image.read(MAX_IMAGE_BYTES + 1)
     
-    if len(image_bytes) > 10 * 1024 * 1024:  # 10MB limit
+    if len(image_bytes) > MAX_IMAGE_BYTES:
         raise HTTPException(
             status_code=400,
             detail="Image too large. Maximum size is 10MB."
         )
     
     # Parse bank provider
-    try:
-        bank = BankProvider(expected_bank.lower())
-    except ValueError:
-        bank = BankProvider.UNKNOWN
+    bank = _BANK_BY_VALUE.get(expected_bank.lower(), BankProvider.UNKNOWN)
     
     # Build context
     context = TransactionContext(
@@ -139,20 +184,7 @@ async def scan_receipt(
     try:
         result = await orchestrator.analyze(image_bytes, context)
         
-        return {
-            "success": True,
-            "analysis": result.analysis.model_dump(),
-            "agents": [
-                {
-                    "name": status.name,
-                    "icon": status.icon,
-                    "status": status.status,
-                    "logs": status.logs
-                }
-                for status in result.agent_statuses
-            ],
-            "logs": result.all_logs
-        }
+        return _scan_response(result)
         
     except Exception as e:
         import traceback
@@ -164,7 +196,7 @@ async def scan_receipt(
         )
 
 
-@app.post("/scan/base64", response_model=dict)
+@app.post("/scan/base64", response_model=ScanResponse)
 async def scan_receipt_base64(
     image_base64: str = Form(...),
     claimed_amount: float = Form(...),
@@ -177,9 +209,12 @@ async def scan_receipt_base64(
     Useful for frontend integrations.
     """
     try:
-        # Decode base64
-        if "base64," in image_base64:
-            image_base64 = image_base64.split("base64,")[1]
+        # Strip a "data:image/png;base64," (or bare "image/png;base64,")
+        # header; it is always at the start, so only the first few bytes
+        # are searched
+        marker = image_base64.find("base64,", 0, 128)
+        if marker != -1:
+            image_base64 = image_base64[marker + len("base64,"):]
         
         image_bytes = base64.b64decode(image_base64)
         
@@ -190,10 +225,7 @@ async def scan_receipt_base64(
         )
     
     # Parse bank provider
-    try:
-        bank = BankProvider(expected_bank.lower())
-    except ValueError:
-        bank = BankProvider.UNKNOWN
+    bank = _BANK_BY_VALUE.get(expected_bank.lower(), BankProvider.UNKNOWN)
     
     context = TransactionContext(
         claimed_amount=claimed_amount,
@@ -205,20 +237,7 @@ async def scan_receipt_base64(
     try:
         result = await orchestrator.analyze(image_bytes, context)
         
-        return {
-            "success": True,
-            "analysis": result.analysis.model_dump(),
-            "agents": [
-                {
-                    "name": status.name,
-                    "icon": status.icon,
-                    "status": status.status,
-                    "logs": status.logs
-                }
-                for status in result.agent_statuses
-            ],
-            "logs": result.all_logs
-        }
+        return _scan_response(result)
         
     except Exception as e:
         raise HTTPException(
@@ -227,27 +246,46 @@ async def scan_receipt_base64(
         )
 
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
-
-# ... (rest of imports)
-
-# ... (at the end of file, before if __name__ == "__main__":)
-
-@app.api_route("/{path_name:path}", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"])
-async def catch_all(request: Request, path_name: str):
+@app.api_route("/", methods=["GET", "POST"])
+async def health_check(request: Request):
     """
-    Debug endpoint to catch path mismatches.
+    Health check & Debug endpoint.
+    Accepts POST to catch 405 errors caused by path stripping.
     """
     return {
-        "status": "debug_catch_all",
-        "message": "Route not found in standard routes, caught by fallback.",
-        "received_method": request.method,
-        "received_path": request.url.path,
-        "raw_path": request.scope.get("path"),
-        "root_path": request.scope.get("root_path"),
-        "path_param": path_name
+        "status": "online",
+        "service": "Deriv P2P Sentinel",
+        "version": "1.0.0",
+        "agents": ["Agent Meta", "Agent Privacy", "Agent Vision"],
+        "debug": {
+            "received_method": request.method,
+            "received_path": request.url.path,
+            "raw_path": request.scope.get("path"),
+            "root_path": request.scope.get("root_path"),
+            "full_scope_path": request.scope.get("path")
+        }
     }
 
+
+# Debug-only: a catch-all route answers every method on every path (including
+# OPTIONS), so it is only registered when explicitly requested
+if os.getenv("DEBUG_CATCH_ALL"):
+    @app.api_route("/{path_name:path}", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"])
+    async def catch_all(request: Request, path_name: str):
+        """
+        Debug endpoint to catch path mismatches.
+        """
+        return {
+            "status": "debug_catch_all",
+            "message": "Route not found in standard routes, caught by fallback.",
+            "received_method": request.method,
+            "received_path": request.url.path,
+            "raw_path": request.scope.get("path"),
+            "root_path": request.scope.get("root_path"),
+            "path_param": path_name
+        }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,29 +1,84 @@
 """
 Orchestrator: Coordinates the multi-agent forensic pipeline.
-Runs Agent Meta → Agent Privacy → Agent Vision in sequence.
+Runs Agent Meta and Agent Privacy concurrently, then Agent Vision.
 """
 
+import asyncio
+import copy
+import hashlib
+import time
+from collections import OrderedDict
 from dataclasses import dataclass, field
+from io import BytesIO
 from typing import List, Optional
+from PIL import Image
 from .agents import MetaAgent, PrivacyAgent, VisionAgent
+from .agents.flags import Flag
+from .agents.meta_agent import MetaAgentResult
+from .agents.privacy_agent import PrivacyAgentResult
+from .agents.vision_agent import VisionAgentResult
 from .schemas import AnalysisResult, ForensicFlag, TransactionContext
 
+# Re-submitted receipts (retries, duplicates) reuse the previous verdict.
+# In-process LRU; multi-worker deployments would need a shared store.
+RESULT_CACHE_MAX_ENTRIES = 1024
+RESULT_CACHE_TTL = 3600.0  # seconds
 
-@dataclass
+# Images bigger than this are re-encoded as WebP before the Gemini upload.
+# Smaller ones are sent untouched so compression artifacts can't mask (or
+# mimic) the editing traces Vision is looking for.
+VISION_MAX_PAYLOAD_BYTES = 1024 * 1024
+VISION_WEBP_QUALITY = 85
+
+
+@dataclass(slots=True)
 class AgentStatus:
     name: str
     icon: str
-    status: str  # "pending", "running", "complete", "error"
+    status: str  # "pending", "running", "complete", "skipped", "error"
     logs: List[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class OrchestratorResult:
     analysis: AnalysisResult
     agent_statuses: List[AgentStatus]
     all_logs: List[str]
 
 
+def _to_forensic_flag(flag) -> ForensicFlag:
+    """Convert an agent Flag into the API's ForensicFlag model."""
+    return ForensicFlag(
+        layer=flag.layer,
+        severity=flag.severity,
+        description=flag.description,
+        confidence=flag.confidence
+    )
+
+
+def _sha256_digest(data: bytes) -> bytes:
+    """Raw SHA-256 digest of data (the result cache key's image part)."""
+    return hashlib.sha256(data).digest()
+
+
+def _compress_for_vision(image_bytes: bytes) -> Optional[bytes]:
+    """
+    WebP re-encode of image_bytes for the Gemini upload. Returns None if
+    encoding fails or doesn't make the payload smaller.
+    """
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        buffer = BytesIO()
+        image.save(buffer, format="WEBP", quality=VISION_WEBP_QUALITY, method=4)
+    except Exception:
+        return None
+    
+    compressed = buffer.getvalue()
+    return compressed if len(compressed) < len(image_bytes) else None
+
+
 class Orchestrator:
     """
     Runs the three-agent forensic pipeline and aggregates results.
@@ -33,6 +88,9 @@ class Orchestrator:
         self.meta_agent = MetaAgent()
         self.privacy_agent = PrivacyAgent()
         self.vision_agent = VisionAgent()
+        
+        # cache key -> (time.monotonic() expiry, OrchestratorResult), oldest first
+        self._result_cache: OrderedDict = OrderedDict()
     
     async def analyze(
         self,
@@ -49,42 +107,54 @@ class Orchestrator:
         Returns:
             OrchestratorResult with final risk score and all agent outputs
         """
+        # hashlib releases the GIL on large buffers, so hash on a worker thread
+        digest = await asyncio.to_thread(_sha256_digest, image_bytes)
+        cache_key = (
+            digest,
+            context.claimed_amount,
+            context.expected_bank.value,
+            context.transaction_time
+        )
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         all_flags: List[ForensicFlag] = []
         all_logs: List[str] = []
         agent_statuses: List[AgentStatus] = []
         
-        # ===== STAGE 1: Agent Meta =====
+        # ===== STAGES 1 + 2: Agent Meta & Agent Privacy (concurrent) =====
+        # Both read the upload independently; only Vision needs Privacy's output
         meta_status = AgentStatus(
             name=self.meta_agent.name,
             icon=self.meta_agent.icon,
             status="running"
         )
-        
-        meta_result = self.meta_agent.analyze(image_bytes)
-        meta_status.status = "complete"
-        meta_status.logs = self.meta_agent.get_status_log(meta_result)
-        agent_statuses.append(meta_status)
-        all_logs.extend(meta_status.logs)
-        
-        # Convert meta flags
-        for flag in meta_result.flags:
-            all_flags.append(ForensicFlag(**flag))
-        
-        # ===== STAGE 2: Agent Privacy =====
         privacy_status = AgentStatus(
             name=self.privacy_agent.name,
             icon=self.privacy_agent.icon,
             status="running"
         )
         
-        privacy_result = self.privacy_agent.analyze(image_bytes)
-        privacy_status.status = "complete"
-        privacy_status.logs = self.privacy_agent.get_status_log(privacy_result)
-        agent_statuses.append(privacy_status)
-        all_logs.extend(privacy_status.logs)
+        # return_exceptions: one agent failing must not cancel the other
+        meta_outcome, privacy_outcome = await asyncio.gather(
+            self.meta_agent.analyze(image_bytes),
+            self.privacy_agent.analyze(image_bytes),
+            return_exceptions=True
+        )
         
-        for flag in privacy_result.flags:
-            all_flags.append(ForensicFlag(**flag))
+        meta_result = self._settle_agent(
+            self.meta_agent, meta_status, meta_outcome, MetaAgentResult(), "Metadata"
+        )
+        privacy_result = self._settle_agent(
+            self.privacy_agent, privacy_status, privacy_outcome, PrivacyAgentResult(), "Privacy"
+        )
+        
+        for status, result in ((meta_status, meta_result), (privacy_status, privacy_result)):
+            agent_statuses.append(status)
+            all_logs.extend(status.logs)
+            for flag in result.flags:
+                all_flags.append(_to_forensic_flag(flag))
         
         # ===== STAGE 3: Agent Vision =====
         vision_status = AgentStatus(
@@ -95,20 +165,41 @@ class Orchestrator:
         
         # Use redacted image for vision analysis
         vision_image = privacy_result.redacted_image_bytes or image_bytes
+        vision_mime_type = privacy_result.redacted_mime_type
         vision_context = {
             "claimed_amount": context.claimed_amount,
             "expected_bank": context.expected_bank.value,
             "transaction_time": context.transaction_time
         }
         
-        vision_result = await self.vision_agent.analyze(vision_image, vision_context)
-        vision_status.status = "complete"
-        vision_status.logs = self.vision_agent.get_status_log(vision_result)
+        if meta_result.is_edited:
+            # Metadata already forces a 100 risk score; skip the Gemini call
+            vision_result = VisionAgentResult(
+                font_consistency_score=0,
+                alignment_score=0,
+                explanation="Editing software detected in image metadata; visual analysis skipped."
+            )
+            vision_status.status = "skipped"
+            vision_status.logs = [
+                f"{self.vision_agent.icon} Skipped: editing software detected by metadata"
+            ]
+        else:
+            if len(vision_image) > VISION_MAX_PAYLOAD_BYTES:
+                compressed = await asyncio.to_thread(_compress_for_vision, vision_image)
+                if compressed is not None:
+                    vision_image = compressed
+                    vision_mime_type = "image/webp"
+            
+            vision_result = await self.vision_agent.analyze(
+                vision_image, vision_context, mime_type=vision_mime_type
+            )
+            vision_status.status = "complete"
+            vision_status.logs = self.vision_agent.get_status_log(vision_result)
         agent_statuses.append(vision_status)
         all_logs.extend(vision_status.logs)
         
         for flag in vision_result.flags:
-            all_flags.append(ForensicFlag(**flag))
+            all_flags.append(_to_forensic_flag(flag))
         
         # ===== RISK SCORING =====
         risk_score = self._calculate_risk_score(
@@ -145,11 +236,62 @@ class Orchestrator:
             explanation=vision_result.explanation or "Analysis complete."
         )
         
-        return OrchestratorResult(
+        result = OrchestratorResult(
             analysis=analysis,
             agent_statuses=agent_statuses,
             all_logs=all_logs
         )
+        
+        # Only cache complete runs; a Meta/Privacy failure (the agents catch
+        # their own errors), a failed Gemini call (e.g. every model rate
+        # limited) or an unparseable response should be retried next time
+        vision_ok = vision_status.status == "skipped" or vision_result.parsed
+        if vision_ok and not meta_result.failed and not privacy_result.failed:
+            self._cache_put(cache_key, result)
+        
+        return result
+    
+    def _cache_get(self, key: tuple) -> Optional[OrchestratorResult]:
+        """Cached result for key, or None if absent or expired."""
+        entry = self._result_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._result_cache[key]
+            return None
+        self._result_cache.move_to_end(key)
+        # Callers get their own copy; the cached entry must stay pristine
+        return copy.deepcopy(entry[1])
+    
+    def _cache_put(self, key: tuple, result: OrchestratorResult):
+        """Store result, evicting the least recently used entries past the limit."""
+        self._result_cache[key] = (
+            time.monotonic() + RESULT_CACHE_TTL, copy.deepcopy(result)
+        )
+        self._result_cache.move_to_end(key)
+        while len(self._result_cache) > RESULT_CACHE_MAX_ENTRIES:
+            self._result_cache.popitem(last=False)
+    
+    def _settle_agent(self, agent, status: AgentStatus, outcome, empty_result, layer: str):
+        """
+        Stamp an agent's status once it has finished. If it raised, mark it
+        as errored and return an empty result carrying an error flag.
+        """
+        if isinstance(outcome, BaseException):
+            status.status = "error"
+            empty_result.failed = True
+            status.logs = [f"{agent.icon} [X] {agent.name} failed: {outcome}"]
+            empty_result.flags.append(Flag(
+                layer=layer,
+                severity="LOW",
+                description=f"{agent.name} error: {outcome}",
+                confidence=0.2
+            ))
+            return empty_result
+        
+        status.status = "complete"
+        status.logs = agent.get_status_log(outcome)
+        return outcome
     
     def _calculate_risk_score(
         self,
@@ -198,19 +340,24 @@ class Orchestrator:
                 pass
         
         # 4. Forensic Signals
+        # (steps 2-3 add at most 80; from here on, stop once the cap is reached)
         if vision_result.font_consistency_score < 80:
             score += 20
+            if score >= 100:
+                return 100
         if vision_result.alignment_score < 80:
             score += 20
+            if score >= 100:
+                return 100
         
         # 5. Severity Accumulator (No Cap)
-        high_flags = sum(
-            1 for f in vision_result.flags
-            if f.get("severity") == "HIGH"
-        )
-        score += (high_flags * 20)
+        for f in vision_result.flags:
+            if f.severity == "HIGH":
+                score += 20
+                if score >= 100:
+                    return 100
         
-        return min(score, 100)  # Cap at 100
+        return score
     
     def _get_verdict(self, score: int) -> str:
         """Determine verdict based on risk score."""
@@ -39,3 +39,15 @@ class AnalysisResult(BaseModel):
     
     # Reasoning
     explanation: str
+
+class AgentStatusOut(BaseModel):
+    name: str
+    icon: str
+    status: str
+    logs: List[str]
+
+class ScanResponse(BaseModel):
+    success: bool
+    analysis: AnalysisResult
+    agents: List[AgentStatusOut]
+    logs: List[str]